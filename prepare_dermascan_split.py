@@ -1,8 +1,11 @@
 import os
 import shutil
 import random
+import sys
 from pathlib import Path
 
+from src.integrity import scan_dataset, print_summary
+
 
 BASE = Path("data")
 RAW = BASE / "IMG_CLASSES"
@@ -61,6 +64,10 @@ def split_and_copy(images, class_name):
 
 
 def main():
+    # Optional pre-step: move corrupt / non-RGB raw images to data/quarantine/
+    if "--scan" in sys.argv:
+        print_summary(scan_dataset([RAW]))
+
     # Create folders for all clean classes
     clean_classes = set(CLEAN_NAMES.values()) | EXISTING
     for cls in clean_classes:
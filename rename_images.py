@@ -1,6 +1,8 @@
 from pathlib import Path
 import sys
 
+from src.integrity import scan_dataset, print_summary
+
 VALID_EXTS = {".jpg", ".jpeg", ".png", ".bmp"}
 
 def rename_images(root_dir: Path):
@@ -54,10 +56,19 @@ if __name__ == "__main__":
     # Or for train:
     #   python rename_images.py data/train
 
-    if len(sys.argv) < 2:
-        print("Usage: python rename_images.py <root_folder>")
+    #
+    # Add --scan to quarantine corrupt / non-RGB images first:
+    #   python rename_images.py data/train --scan
+
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if not args:
+        print("Usage: python rename_images.py <root_folder> [--scan]")
         print("Example: python rename_images.py data/test")
         sys.exit(1)
 
-    target = Path(sys.argv[1])
+    target = Path(args[0])
+
+    if "--scan" in sys.argv:
+        print_summary(scan_dataset([target]))
+
     rename_images(target)
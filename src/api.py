@@ -1,18 +1,22 @@
 # src/api.py
 
 import os
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Query
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List
 from pathlib import Path
-import shutil
 import time
-import io
+import hashlib
+import asyncio
 import numpy as np
-from PIL import Image
 
-from .prediction import get_model
-from .preprocessing import NEW_DATA_DIR
+from .prediction import get_model, preprocess_bytes, MODEL_PATH
+from .preprocessing import NEW_DATA_DIR, BASE_DIR
+from .embeddings import EmbeddingIndex, build_index, get_embedding_model, embed_batch
+from .evaluation import PredictionStore, model_version, evaluate, compare_versions
+from .shadow import ShadowRunner, SHADOW_SAMPLE_RATE
+from .audit import AuditLog, read_audit_log
+from .explain import GradCamExplainer
 
 # =========================================================
 #  ENVIRONMENT CHECK
@@ -34,10 +38,30 @@ app.add_middleware(
 
 START_TIME = time.time()
 
+# Prediction audit trail: buffered in memory, flushed to disk in the background
+audit_log = AuditLog().start()
+
+
+@app.on_event("shutdown")
+def close_audit_log():
+    audit_log.close()
+
 # =========================================================
 #  LOAD MODEL (always available)
 # =========================================================
 model = get_model()
+MODEL_VERSION = model_version(MODEL_PATH)
+prediction_store = PredictionStore()
+
+# Marks MODEL_VERSION while /retrain is changing the weights (see /retrain)
+TRAINING_VERSION_TAG = "+training-"
+
+# Where /retrain saves the fine-tuned model (relative to the project root)
+RETRAINED_MODEL = "dermascan_retrained.h5"
+MODELS_DIR = BASE_DIR / "models"
+
+# Candidate model scored off-path on sampled /predict traffic (see /shadow/start)
+shadow = None
 
 # Hardcoded class list so Render does NOT need dataset folders
 CLASS_NAMES = [
@@ -54,19 +78,57 @@ CLASS_NAMES = [
     "warts"
 ]
 
+# Grad-CAM explanations, batched across concurrent requests and cached.
+# A model Grad-CAM cannot handle only disables /explain.
+try:
+    explainer = GradCamExplainer(model, CLASS_NAMES)
+except Exception as e:
+    print("⚠️ Grad-CAM unavailable — /explain disabled:", e)
+    explainer = None
+
+# =========================================================
+#  EMBEDDING INDEX (built offline with `python -m src.embeddings`)
+# =========================================================
+embedding_model = get_embedding_model(model)
+embedding_index = EmbeddingIndex.load()
+if embedding_index is None:
+    print("⚠️ No embedding index found — /similar and duplicate checks disabled.")
+elif embedding_index.model_version != MODEL_VERSION:
+    # Embeddings from another model live in a different space
+    print(f"⚠️ Embedding index was built with model {embedding_index.model_version}, "
+          f"serving {MODEL_VERSION} — rebuild with `python -m src.embeddings`.")
+    embedding_index = None
+else:
+    print(f"🔵 Loaded embedding index with {len(embedding_index)} images.")
+
 # =========================================================
 #  LOCAL TRAINING DATA (ONLY when not on Render)
 # =========================================================
+def load_local_datasets():
+    """
+    Quarantines unreadable images first, then checks for base training
+    images and builds the test dataset from what is left, so its file list
+    never points at moved files. The training pipeline itself is only built
+    by /retrain (load_retrain_dataset).
+    """
+    from .integrity import scan_dataset, print_summary
+    from .preprocessing import has_base_data, load_test_dataset, TRAIN_DIR, TEST_DIR
+
+    scan = scan_dataset([TRAIN_DIR, TEST_DIR, NEW_DATA_DIR])
+    print_summary(scan)
+
+    return has_base_data(), load_test_dataset(), scan
+
+
 if not IS_RENDER:
     try:
-        from .preprocessing import load_train_test_datasets
-        train_ds, test_ds, _ = load_train_test_datasets()
+        base_data_ready, test_ds, _ = load_local_datasets()
         print("🔵 Loaded dataset locally for training.")
     except Exception as e:
         print("⚠️ Local dataset loading failed:", e)
-        train_ds, test_ds = None, None
+        base_data_ready, test_ds = False, None
 else:
-    train_ds = None
+    base_data_ready = False
     test_ds = None
     print("🟣 Running on Render — dataset loading & retraining disabled.")
 
@@ -88,6 +150,7 @@ def health():
         "status": "ok",
         "uptime_seconds": round(time.time() - START_TIME, 1),
         "running_on_render": IS_RENDER,
+        "model_version": MODEL_VERSION,
         "num_classes": len(CLASS_NAMES),
         "classes": CLASS_NAMES,
     }
@@ -99,18 +162,32 @@ def health():
 @app.post("/predict")
 async def predict(file: UploadFile = File(...)):
     try:
+        start = time.perf_counter()
         img_bytes = await file.read()
-        img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-
-        img_resized = img.resize((256, 256))
-        img_array = np.array(img_resized) / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
+        # uint8 (1, 256, 256, 3), same decode + resize as training;
+        # the model rescales in-graph
+        img_array = preprocess_bytes(img_bytes)
 
         preds = model.predict(img_array)
         confidence = float(np.max(preds))
         class_index = int(np.argmax(preds))
         class_name = CLASS_NAMES[class_index]
 
+        # Non-blocking: sample is queued or dropped, never waited on.
+        # Read the global once: /shadow/stop may clear it concurrently.
+        runner = shadow
+        if runner is not None:
+            runner.submit(img_array, preds[0])
+
+        # In-memory append only; disk writes happen in the audit thread
+        audit_log.record(
+            input_hash=hashlib.sha1(img_bytes).hexdigest(),
+            class_name=class_name,
+            confidence=confidence,
+            model_version=MODEL_VERSION,
+            latency_ms=(time.perf_counter() - start) * 1000,
+        )
+
         return {
             "class_name": class_name,
             "confidence": confidence
@@ -120,13 +197,66 @@ async def predict(file: UploadFile = File(...)):
         return {"error": str(e)}
 
 
+# =========================================================
+#  EXPLAIN (prediction + Grad-CAM heatmap in one pass)
+# =========================================================
+@app.post("/explain")
+async def explain(file: UploadFile = File(...)):
+    """
+    Returns the predicted class, confidence and a Grad-CAM overlay
+    (base64 JPEG) showing which region drove the prediction.
+    """
+    if explainer is None:
+        return {"error": "Grad-CAM is not available for the served model."}
+
+    try:
+        start = time.perf_counter()
+        img_bytes = await file.read()
+        img_array = preprocess_bytes(img_bytes)
+
+        version = MODEL_VERSION
+        key = (hashlib.sha1(img_bytes).hexdigest(), version)
+        result = await asyncio.wrap_future(explainer.submit(key, img_array))
+        took_ms = (time.perf_counter() - start) * 1000
+
+        # A prediction like /predict's, so it goes into the audit trail too
+        audit_log.record(
+            input_hash=key[0],
+            class_name=result["class_name"],
+            confidence=result["confidence"],
+            model_version=version,
+            latency_ms=took_ms,
+        )
+
+        return {
+            **result,
+            "model_version": version,
+            "took_ms": round(took_ms, 2),
+        }
+
+    except Exception as e:
+        return {"error": str(e)}
+
+
+@app.get("/explain/stats")
+def explain_stats():
+    if explainer is None:
+        return {"status": "disabled"}
+    return explainer.stats()
+
+
 # =========================================================
 #  UPLOAD BULK (Enabled locally, simulated on Render)
 # =========================================================
 @app.post("/upload-bulk")
-async def upload_bulk(files: List[UploadFile] = File(...)):
+async def upload_bulk(
+    files: List[UploadFile] = File(...),
+    skip_duplicates: bool = Query(True),
+):
     """
     Upload extra images to /data/new_data for retraining.
+    Near-duplicates of images already in the embedding index are
+    skipped (or only flagged when skip_duplicates=false).
     On Render: simulated only.
     """
 
@@ -135,6 +265,8 @@ async def upload_bulk(files: List[UploadFile] = File(...)):
 
     NEW_DATA_DIR.mkdir(parents=True, exist_ok=True)
     saved = 0
+    duplicates = []
+    index = embedding_index   # may be disabled concurrently by /retrain
 
     for f in files:
         name = f.filename
@@ -148,12 +280,65 @@ async def upload_bulk(files: List[UploadFile] = File(...)):
         target_dir.mkdir(parents=True, exist_ok=True)
 
         dest = target_dir / name
+        img_bytes = await f.read()
+
+        vector = None
+        if index is not None:
+            try:
+                vector = embed_batch(embedding_model, preprocess_bytes(img_bytes))
+                match = index.find_duplicate(vector)
+            except Exception:
+                match = None
+
+            if match is not None:
+                duplicates.append({"file": name, "duplicate_of": match["path"],
+                                   "similarity": match["similarity"]})
+                if skip_duplicates:
+                    continue
+
         with open(dest, "wb") as buffer:
-            shutil.copyfileobj(f.file, buffer)
+            buffer.write(img_bytes)
+
+        # Keep the index current so later uploads in the same batch are checked too
+        if vector is not None:
+            index.add(vector, [str(dest.relative_to(BASE_DIR))], [class_name])
 
         saved += 1
 
-    return {"status": "saved", "files_saved": saved}
+    return {
+        "status": "saved",
+        "files_saved": saved,
+        "duplicates": duplicates,
+        "duplicates_skipped": len(duplicates) if skip_duplicates else 0,
+    }
+
+
+# =========================================================
+#  SIMILAR CASES (nearest neighbours in the embedding index)
+# =========================================================
+@app.post("/similar")
+async def similar(file: UploadFile = File(...), k: int = Query(5, ge=1, le=50)):
+    """
+    Returns the k reference images most similar to the uploaded one.
+    """
+    index = embedding_index
+    if index is None:
+        return {"error": "Embedding index not built for the current model. "
+                         "Run: python -m src.embeddings"}
+
+    try:
+        start = time.perf_counter()
+        img_bytes = await file.read()
+        vector = embed_batch(embedding_model, preprocess_bytes(img_bytes))
+        matches = index.most_similar(vector, k=k)
+
+        return {
+            "matches": matches,
+            "took_ms": round((time.perf_counter() - start) * 1000, 2),
+        }
+
+    except Exception as e:
+        return {"error": str(e)}
 
 
 # =========================================================
@@ -174,33 +359,212 @@ def retrain():
     #         "message": "Retraining cannot run on Render. Demo this locally."
     #     }
 
-    if train_ds is None:
-        return {"status": "error", "message": "No training dataset available"}
+    global MODEL_VERSION, base_data_ready, test_ds, embedding_index
 
     try:
-        from .preprocessing import load_new_data_dataset
+        from .preprocessing import load_retrain_dataset
         from .model import fine_tune
 
-        new_ds = load_new_data_dataset()
-        if new_ds is None:
+        # Re-scan (cached, only changed files are decoded) and rebuild the
+        # datasets so nothing quarantined since startup is still referenced
+        base_data_ready, test_ds, scan = load_local_datasets()
+    except Exception as e:
+        return {"status": "error", "message": f"Dataset loading failed: {e}"}
+
+    if not base_data_ready:
+        return {
+            "status": "error",
+            "message": "No valid base training images in data/train",
+            "quarantined_files": scan["quarantined"],
+        }
+
+    try:
+        # Base + new data mixed by weighted sampling, streamed from disk
+        combined_train = load_retrain_dataset()
+        if combined_train is None:
             return {"status": "no_new_data"}
 
-        combined_train = train_ds.concatenate(new_ds)
+        # fine_tune changes the served model's weights in place. From here on
+        # the old version id (and everything cached under it: stored
+        # predictions, heatmaps, embeddings) no longer describes the model,
+        # even if training or saving fails part-way.
+        previous_version = MODEL_VERSION
+        MODEL_VERSION = f"{previous_version}{TRAINING_VERSION_TAG}{int(time.time())}"
 
-        updated_model, history = fine_tune(
+        # embedding_model shares the fine-tuned layers, so stored vectors no
+        # longer match new queries until the index is rebuilt
+        if embedding_index is not None:
+            print("⚠️ Embedding index disabled while the model is retrained.")
+            embedding_index = None
+
+        updated_model, history, report = fine_tune(
             model,
             combined_train,
             test_ds,
-            model_path="dermascan_retrained.h5",
+            model_path=RETRAINED_MODEL,
             epochs=5,
         )
 
+        # The saved file now identifies the served weights
+        MODEL_VERSION = model_version(BASE_DIR / RETRAINED_MODEL)
+        metrics = evaluate(updated_model, MODEL_VERSION, CLASS_NAMES, store=prediction_store)
+
+        # Re-embed the reference images with the retrained model, so /similar
+        # and duplicate checks work again without a separate offline step
+        try:
+            embedding_index = build_index(updated_model, MODEL_VERSION)
+        except Exception as e:
+            print("⚠️ Embedding index rebuild failed — rebuild with `python -m src.embeddings`:", e)
+
         return {
             "status": "retrained",
-            "epochs": len(history.history["accuracy"]),
+            "epochs": report["epochs_completed"],
             "final_train_acc": float(history.history["accuracy"][-1]),
             "final_val_acc": float(history.history["val_accuracy"][-1]),
+            "best_val_acc": report["best_val_accuracy"],
+            "stopped_early": report["stopped_early"],
+            "resumed_from_epoch": report["resumed_from_epoch"],
+            "epochs_saved": report["epochs_saved"],
+            "seconds_saved": report["estimated_seconds_saved"],
+            "epochs_recovered": report["epochs_recovered"],
+            "seconds_recovered": report["estimated_seconds_recovered"],
+            "pipeline_images_per_sec": report["pipeline_images_per_sec"],
+            "train_images_per_sec": report["train_images_per_sec"],
+            "input_bound": report["input_bound"],
+            "model_version": MODEL_VERSION,
+            "previous_model_version": previous_version,
+            "test_accuracy": metrics["accuracy"],
+            "embedding_index_size": len(embedding_index) if embedding_index is not None else None,
+            "quarantined_files": scan["quarantined"],
         }
 
     except Exception as e:
         return {"status": "error", "message": str(e)}
+
+
+# =========================================================
+#  EVALUATION (cached per image hash + model version)
+# =========================================================
+@app.get("/evaluate")
+def evaluate_model():
+    """
+    Confusion matrix + per-class precision/recall for the current model.
+    Only new or changed test images are run through the model.
+    """
+    version = MODEL_VERSION
+    if TRAINING_VERSION_TAG in version:
+        # The weights are mid-training (or a retrain failed before saving):
+        # predictions stored under this throwaway version could never be reused
+        return {"error": "Model is being retrained and has no saved version yet; "
+                         "evaluate after /retrain has finished."}
+
+    try:
+        return evaluate(model, version, CLASS_NAMES, store=prediction_store)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+@app.get("/evaluate/compare")
+def evaluate_compare(a: str, b: str = None):
+    """
+    Compares two evaluated model versions from stored predictions.
+    `b` defaults to the current model version.
+    """
+    try:
+        return compare_versions(a, b or MODEL_VERSION, CLASS_NAMES, store=prediction_store)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+@app.get("/evaluate/versions")
+def evaluate_versions():
+    return {"current": MODEL_VERSION, "evaluated": prediction_store.versions()}
+
+
+# =========================================================
+#  SHADOW MODE (candidate model on sampled live traffic)
+# =========================================================
+def _candidate_model_path(model_path: str):
+    """
+    Resolves a shadow candidate path. Loading a .h5 file can run code
+    (Lambda layers), so only the /retrain output and files under models/
+    are accepted, never e.g. an uploaded file in data/.
+    """
+    path = (BASE_DIR / model_path).resolve()
+    allowed = (
+        path == (BASE_DIR / RETRAINED_MODEL).resolve()
+        or (path.is_relative_to(MODELS_DIR.resolve()) and path.suffix in (".h5", ".keras"))
+    )
+    if not allowed:
+        raise ValueError(f"Candidate model must be {RETRAINED_MODEL} or a model file in models/")
+    if not path.is_file():
+        raise ValueError(f"Candidate model not found: {model_path}")
+    return path
+
+
+@app.post("/shadow/start")
+def shadow_start(
+    model_path: str = RETRAINED_MODEL,
+    sample_rate: float = Query(SHADOW_SAMPLE_RATE, gt=0.0, le=1.0),
+):
+    """
+    Loads a candidate model (the /retrain output, or a file in models/)
+    and starts scoring a sample of /predict inputs with it in the background.
+    """
+    global shadow
+
+    try:
+        from .model import get_model as load_candidate
+
+        path = _candidate_model_path(model_path)
+        candidate = load_candidate(path)
+        version = model_version(path)
+
+        if shadow is not None:
+            shadow.stop()
+        shadow = ShadowRunner(candidate, version, CLASS_NAMES, sample_rate=sample_rate).start()
+
+        return {"status": "shadow_started", "candidate_version": version,
+                "serving_version": MODEL_VERSION, "sample_rate": sample_rate}
+
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+
+@app.get("/shadow/stats")
+def shadow_stats():
+    runner = shadow
+    if runner is None:
+        return {"status": "inactive"}
+    return {"status": "active", "serving_version": MODEL_VERSION, **runner.stats()}
+
+
+@app.post("/shadow/stop")
+def shadow_stop():
+    global shadow
+
+    runner, shadow = shadow, None
+    if runner is None:
+        return {"status": "inactive"}
+
+    runner.stop()
+    final = runner.stats()
+    return {"status": "shadow_stopped", **final}
+
+
+# =========================================================
+#  AUDIT LOG
+# =========================================================
+@app.get("/audit")
+def audit(
+    start: float = None,
+    end: float = None,
+    class_name: str = None,
+    limit: int = Query(1000, ge=1, le=100000),
+):
+    """
+    Prediction records with start <= ts < end (unix seconds),
+    optionally filtered by predicted class.
+    """
+    records = list(read_audit_log(start=start, end=end, class_name=class_name, limit=limit))
+    return {"count": len(records), "records": records, "log": audit_log.stats()}
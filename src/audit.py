@@ -0,0 +1,244 @@
+# src/audit.py
+
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+
+# -------------------------------------
+# AUDIT LOG SETTINGS
+# -------------------------------------
+AUDIT_DIR = BASE_DIR / "logs" / "audit"
+AUDIT_BUFFER_SIZE = int(os.getenv("DERMASCAN_AUDIT_BUFFER", "10000"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("DERMASCAN_AUDIT_FLUSH_SECONDS", "2.0"))
+AUDIT_SEGMENT_BYTES = int(os.getenv("DERMASCAN_AUDIT_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+
+SEGMENT_PREFIX = "audit-"
+SEGMENT_SUFFIX = ".jsonl.gz"
+
+
+def _segment_key(path: Path):
+    """
+    Segments are named audit-<first record time in ms>[-<n>].jsonl.gz;
+    the -<n> suffix keeps names unique when a segment is reopened for the
+    same first record (e.g. retrying a failed write).
+    """
+    ms, _, n = path.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)].partition("-")
+    return int(ms), int(n or 0)
+
+
+def _segment_start(path: Path):
+    return _segment_key(path)[0] / 1000.0
+
+
+def list_segments(log_dir: Path = AUDIT_DIR):
+    return sorted(Path(log_dir).glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"), key=_segment_key)
+
+
+# -------------------------------------
+# WRITER
+# -------------------------------------
+class AuditLog:
+    """
+    Append-only prediction audit log.
+
+    record() only appends to an in-memory ring buffer, so the request path
+    never touches the disk. A background thread drains the buffer every
+    flush interval and appends it as one gzip member to the current
+    segment, rotating to a new segment once it exceeds the size limit.
+
+    Loss policy: if the disk falls behind and the buffer fills, the oldest
+    unflushed records are dropped. A batch whose write fails goes back into
+    the buffer under the same rule. Every drop is counted and a marker
+    record with the count is written, so gaps are visible in the log.
+    """
+
+    def __init__(
+        self,
+        log_dir: Path = AUDIT_DIR,
+        buffer_size=AUDIT_BUFFER_SIZE,
+        flush_seconds=AUDIT_FLUSH_SECONDS,
+        segment_bytes=AUDIT_SEGMENT_BYTES,
+    ):
+        self.log_dir = Path(log_dir)
+        self.flush_seconds = flush_seconds
+        self.segment_bytes = segment_bytes
+
+        self._buffer = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="audit-log", daemon=True)
+        self._segment = None
+
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self._unreported_drops = 0
+
+    # ---------- lifecycle ----------
+    def start(self):
+        # Always open a new segment: the previous one may end in a gzip
+        # member truncated by a crash, and appending after it would make
+        # everything written later unreadable.
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self._segment = None
+        self._thread.start()
+        return self
+
+    def close(self, timeout=5.0):
+        self._stop.set()
+        self._thread.join(timeout)
+        self.flush()
+
+    # ---------- request path ----------
+    def record(self, input_hash, class_name, confidence, model_version, latency_ms):
+        entry = {
+            "ts": round(time.time(), 3),
+            "input_hash": input_hash,
+            "class_name": class_name,
+            "confidence": round(float(confidence), 6),
+            "model_version": model_version,
+            "latency_ms": round(float(latency_ms), 2),
+        }
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+                self._unreported_drops += 1
+            self._buffer.append(entry)
+            self.recorded += 1
+
+    # ---------- background flush ----------
+    def _run(self):
+        while not self._stop.wait(self.flush_seconds):
+            try:
+                self.flush()
+            except OSError as e:
+                print("⚠️ Audit log flush failed:", e)
+
+    def _drain(self):
+        with self._lock:
+            entries = list(self._buffer)
+            self._buffer.clear()
+            drops, self._unreported_drops = self._unreported_drops, 0
+
+        if drops:
+            entries.append({"ts": round(time.time(), 3), "dropped": drops})
+        return entries
+
+    def _requeue(self, entries):
+        """
+        Puts a batch that failed to write back in front of newer records.
+        What no longer fits is dropped oldest-first and counted.
+        """
+        records = [e for e in entries if "dropped" not in e]
+        markers = sum(e["dropped"] for e in entries if "dropped" in e)
+
+        with self._lock:
+            room = self._buffer.maxlen - len(self._buffer)
+            lost = max(0, len(records) - room)
+            for entry in reversed(records[lost:]):
+                self._buffer.appendleft(entry)
+            self.dropped += lost
+            self._unreported_drops += markers + lost
+
+    def _current_segment(self, first_ts):
+        if self._segment is None or (
+            self._segment.exists() and self._segment.stat().st_size >= self.segment_bytes
+        ):
+            # Never reopen an existing file: it may end in a partial member
+            stem = f"{SEGMENT_PREFIX}{int(first_ts * 1000)}"
+            segment, n = self.log_dir / f"{stem}{SEGMENT_SUFFIX}", 0
+            while segment.exists():
+                n += 1
+                segment = self.log_dir / f"{stem}-{n}{SEGMENT_SUFFIX}"
+            self._segment = segment
+        return self._segment
+
+    def flush(self):
+        """Writes everything buffered so far as one compressed batch."""
+        with self._flush_lock:
+            entries = self._drain()
+            if not entries:
+                return 0
+
+            payload = "".join(json.dumps(e, separators=(",", ":")) + "\n" for e in entries)
+            try:
+                segment = self._current_segment(entries[0]["ts"])
+                with open(segment, "ab") as f:
+                    f.write(gzip.compress(payload.encode("utf-8")))
+            except OSError:
+                # A partial member may be on disk; continue in a new segment
+                self._segment = None
+                self._requeue(entries)
+                raise
+
+            self.written += len(entries)
+            return len(entries)
+
+    def stats(self):
+        with self._lock:
+            buffered = len(self._buffer)
+        return {
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "buffered": buffered,
+            "segments": len(list_segments(self.log_dir)),
+        }
+
+
+# -------------------------------------
+# READER
+# -------------------------------------
+def read_audit_log(log_dir: Path = AUDIT_DIR, start=None, end=None, class_name=None, limit=None):
+    """
+    Yields audit records with start <= ts < end (unix seconds) and an
+    optional class filter. Segments that cannot overlap the time range are
+    skipped by name, without being opened.
+    """
+    segments = list_segments(log_dir)
+    returned = 0
+
+    for i, segment in enumerate(segments):
+        seg_start = _segment_start(segment)
+        seg_end = _segment_start(segments[i + 1]) if i + 1 < len(segments) else float("inf")
+        if end is not None and seg_start >= end:
+            break
+        if start is not None and seg_end <= start:
+            continue
+
+        for entry in _read_segment(segment):
+            if "dropped" in entry:
+                continue
+            ts = entry["ts"]
+            if start is not None and ts < start:
+                continue
+            if end is not None and ts >= end:
+                continue
+            if class_name is not None and entry["class_name"] != class_name:
+                continue
+
+            yield entry
+            returned += 1
+            if limit is not None and returned >= limit:
+                return
+
+
+def _read_segment(segment: Path):
+    try:
+        with gzip.open(segment, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+    except (EOFError, OSError, zlib.error):
+        # Truncated last gzip member after a crash: keep what was readable
+        return
@@ -0,0 +1,328 @@
+# src/embeddings.py
+
+import json
+import os
+import numpy as np
+import tensorflow as tf
+from pathlib import Path
+
+from .preprocessing import (
+    BASE_DIR,
+    TRAIN_DIR,
+    TEST_DIR,
+    NEW_DATA_DIR,
+    IMG_EXTS,
+    load_image_dataset,
+    with_preprocessing,
+    unwrap_preprocessing,
+)
+
+# Optional: approximate nearest-neighbour search for large indexes
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# -------------------------------------
+# INDEX LOCATION / SETTINGS
+# -------------------------------------
+INDEX_DIR = BASE_DIR / "models" / "embeddings"
+VECTORS_FILE = "vectors.f32"   # raw float32 matrix, memory-mapped on load
+META_FILE = "meta.json"        # paths, labels, dimension, model version
+JOURNAL_FILE = "added.jsonl"   # one line per row appended since meta.json was written
+
+# Cosine similarity above which two images are treated as the same picture
+DUPLICATE_THRESHOLD = 0.97
+
+# Below this size the exact (brute-force) search is already sub-millisecond
+ANN_MIN_SIZE = 50_000
+
+
+# -------------------------------------
+# EMBEDDING MODEL
+# -------------------------------------
+def get_embedding_model(model):
+    """
+    Wraps the classifier so it outputs the penultimate layer
+    (the pooled features feeding the final Dense softmax).
+    """
+    classifier = unwrap_preprocessing(model)
+    features = classifier.layers[-2].output
+    if len(features.shape) > 2:
+        features = tf.keras.layers.Flatten()(features)
+    return with_preprocessing(tf.keras.Model(inputs=classifier.inputs, outputs=features))
+
+
+def _l2_normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def embed_batch(embedding_model, img_array):
+    """Unit-length embeddings for a batch of uint8 images."""
+    return _l2_normalize(embedding_model.predict(img_array, verbose=0))
+
+
+# -------------------------------------
+# INDEX
+# -------------------------------------
+class EmbeddingIndex:
+    """
+    Float32 matrix of unit-length embeddings stored on disk and memory-mapped,
+    so startup is instant. Search is a single matrix-vector product
+    (cosine similarity).
+
+    Single writer: add() appends to the files without any cross-process
+    lock, and other processes do not see the new rows. Run the API as one
+    worker while it adds to the index (uvicorn's default).
+
+    Rows added after a build are recorded in an append-only journal instead
+    of rewriting meta.json; the journal is folded into meta.json on load.
+    Vectors are always written before their journal line, so after a crash
+    the vector file can only be longer than the metadata, and load() trims it.
+
+    Embeddings are only comparable within one model version: meta.json
+    records the version the index was built with.
+    """
+
+    def __init__(self, index_dir: Path = INDEX_DIR, model_version=None):
+        self.index_dir = Path(index_dir)
+        self.model_version = model_version
+        self.paths = []
+        self.labels = []
+        self.dim = 0
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self._ann = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    # ---------- persistence ----------
+    @classmethod
+    def load(cls, index_dir: Path = INDEX_DIR):
+        """
+        Returns the saved index, or None if it has not been built yet or
+        the files are inconsistent (rebuild with `python -m src.embeddings`).
+        """
+        index = cls(index_dir)
+        meta_path = index.index_dir / META_FILE
+        if not meta_path.exists():
+            return None
+
+        meta = json.loads(meta_path.read_text())
+        index.paths = meta["paths"]
+        index.labels = meta["labels"]
+        index.dim = meta["dim"]
+        index.model_version = meta.get("model_version")
+
+        journal_path = index.index_dir / JOURNAL_FILE
+        if journal_path.exists():
+            for line in journal_path.read_text(encoding="utf-8").splitlines():
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    break   # partial last line from a crash
+                index.paths.append(row["path"])
+                index.labels.append(row["label"])
+
+        if not index._check_vector_file():
+            return None
+
+        # Fold the journal into meta.json so it does not grow without bound
+        if journal_path.exists():
+            index._write_meta()
+            journal_path.unlink()
+
+        index._map_vectors()
+        index._build_ann()
+        return index
+
+    def _check_vector_file(self):
+        """Vector file must hold exactly len(paths) rows; trims rows without metadata."""
+        vec_path = self.index_dir / VECTORS_FILE
+        expected = len(self.paths) * self.dim * 4
+        actual = vec_path.stat().st_size if vec_path.exists() else 0
+
+        if actual > expected:
+            print(f"⚠️ Trimming {(actual - expected) // 4 // max(self.dim, 1)} "
+                  f"embedding rows without metadata")
+            with open(vec_path, "r+b") as f:
+                f.truncate(expected)
+        elif actual < expected:
+            print(f"⚠️ Embedding index is inconsistent ({actual} bytes, expected {expected}).")
+            return False
+        return True
+
+    def _map_vectors(self):
+        vec_path = self.index_dir / VECTORS_FILE
+        if not self.paths or not vec_path.exists():
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+            return
+        self.vectors = np.memmap(
+            vec_path, dtype=np.float32, mode="r", shape=(len(self.paths), self.dim)
+        )
+
+    def _write_meta(self):
+        """Atomic: written to a temp file, then renamed over meta.json."""
+        meta = {
+            "paths": self.paths,
+            "labels": self.labels,
+            "dim": self.dim,
+            "model_version": self.model_version,
+        }
+        tmp = self.index_dir / (META_FILE + ".tmp")
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, self.index_dir / META_FILE)
+
+    def _build_ann(self):
+        self._ann = None
+        if faiss is None or len(self) < ANN_MIN_SIZE:
+            return
+        ann = faiss.IndexHNSWFlat(self.dim, 32, faiss.METRIC_INNER_PRODUCT)
+        ann.add(np.ascontiguousarray(self.vectors))
+        self._ann = ann
+
+    def add(self, vectors, paths, labels, journal=True):
+        """
+        Appends embeddings to the on-disk matrix and remaps it.
+        With journal=True the new rows are recorded in the journal (O(rows)),
+        otherwise the caller must call _write_meta() afterwards.
+        """
+        vectors = _l2_normalize(vectors)
+        if not self.dim:
+            self.dim = vectors.shape[1]
+
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.index_dir / VECTORS_FILE, "ab") as f:
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        if journal:
+            with open(self.index_dir / JOURNAL_FILE, "a", encoding="utf-8") as f:
+                for path, label in zip(paths, labels):
+                    f.write(json.dumps({"path": path, "label": label}) + "\n")
+
+        self.paths.extend(paths)
+        self.labels.extend(labels)
+        self._map_vectors()
+
+        if self._ann is not None:
+            self._ann.add(vectors)
+        elif faiss is not None and len(self) >= ANN_MIN_SIZE:
+            self._build_ann()
+
+    # ---------- search ----------
+    def search(self, queries, k=5):
+        """
+        Args:
+            queries: (n, dim) embeddings
+            k: neighbours per query
+
+        Returns:
+            (similarities, indices) — both shaped (n, k), best first
+        """
+        queries = _l2_normalize(np.atleast_2d(queries))
+        k = min(k, len(self))
+        if k == 0:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.float32), empty.astype(np.int64)
+
+        if self._ann is not None:
+            return self._ann.search(queries, k)
+
+        sims = queries @ self.vectors.T
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        return (
+            np.take_along_axis(top_sims, order, axis=1),
+            np.take_along_axis(top, order, axis=1),
+        )
+
+    def most_similar(self, query, k=5):
+        """Nearest reference images for a single query embedding."""
+        sims, idx = self.search(query, k)
+        return [
+            {
+                "path": self.paths[i],
+                "class_name": self.labels[i],
+                "similarity": round(float(s), 4),
+            }
+            for s, i in zip(sims[0], idx[0])
+            if i >= 0
+        ]
+
+    def find_duplicate(self, query, threshold=DUPLICATE_THRESHOLD):
+        """Closest match if it is a near-duplicate of the query, else None."""
+        matches = self.most_similar(query, k=1)
+        if matches and matches[0]["similarity"] >= threshold:
+            return matches[0]
+        return None
+
+
+# -------------------------------------
+# BUILD FROM DATA FOLDERS
+# -------------------------------------
+def _collect_images(roots):
+    paths, labels = [], []
+    for root in roots:
+        if not root.exists():
+            continue
+        for img_path in sorted(root.glob("*/*")):
+            if img_path.is_file() and img_path.suffix.lower() in IMG_EXTS:
+                paths.append(img_path)
+                labels.append(img_path.parent.name)
+    return paths, labels
+
+
+def build_index(model, model_version, roots=(TRAIN_DIR, TEST_DIR, NEW_DATA_DIR),
+                index_dir: Path = INDEX_DIR, batch_size=64):
+    """
+    Embeds every image in the data folders and writes a fresh index
+    tagged with model_version.
+    Vectors are streamed to disk batch by batch, so memory stays flat.
+    """
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    for name in (META_FILE, JOURNAL_FILE, VECTORS_FILE):
+        (index_dir / name).unlink(missing_ok=True)
+
+    paths, labels = _collect_images(roots)
+    print(f"📌 Embedding {len(paths)} images into {index_dir}")
+
+    embedding_model = get_embedding_model(model)
+    index = EmbeddingIndex(index_dir, model_version=model_version)
+
+    ds = load_image_dataset([str(p) for p in paths], batch_size=batch_size)
+    offset = 0
+    for batch in ds:
+        n = int(batch.shape[0])
+        rel_paths = [str(p.relative_to(BASE_DIR)) for p in paths[offset:offset + n]]
+        index.add(
+            embed_batch(embedding_model, batch),
+            rel_paths,
+            labels[offset:offset + n],
+            journal=False,
+        )
+        offset += n
+
+    index._write_meta()
+    index._build_ann()
+    print(f"✅ Embedding index built: {len(index)} vectors, dim={index.dim}")
+    return index
+
+
+if __name__ == "__main__":
+    # ---- HOW TO CALL IT ----
+    #   python -m src.embeddings                          (base model)
+    #   python -m src.embeddings dermascan_retrained.h5   (after /retrain)
+    # The model file decides the version the index is tagged with; it must
+    # match the model the API is serving.
+    import sys
+    from .model import get_model
+    from .evaluation import model_version
+
+    model_file = sys.argv[1] if len(sys.argv) > 1 else "models/dermascan_base.h5"
+    build_index(get_model(model_file), model_version(BASE_DIR / model_file))
@@ -0,0 +1,244 @@
+# src/evaluation.py
+
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from pathlib import Path
+
+from .preprocessing import BASE_DIR, TEST_DIR, IMG_EXTS, load_image_dataset
+
+# -------------------------------------
+# STORE LOCATION
+# -------------------------------------
+EVAL_DB = BASE_DIR / "models" / "evaluation" / "predictions.db"
+
+
+# -------------------------------------
+# HASHING (model version + image content)
+# -------------------------------------
+def _file_sha1(path: Path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def model_version(model_path):
+    """Short content hash of a saved model file, used as its version id."""
+    return _file_sha1(Path(model_path))[:12]
+
+
+# -------------------------------------
+# PREDICTION STORE
+# -------------------------------------
+class PredictionStore:
+    """
+    SQLite table of softmax outputs keyed by (image hash, model version),
+    plus a (path, size, mtime) → hash cache so unchanged files are not re-read.
+
+    One connection is shared by the API's worker threads, so every use of
+    it is serialised by a lock.
+    """
+
+    def __init__(self, db_path: Path = EVAL_DB):
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS predictions (
+                image_hash TEXT NOT NULL,
+                model_version TEXT NOT NULL,
+                probs BLOB NOT NULL,
+                PRIMARY KEY (image_hash, model_version)
+            );
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                image_hash TEXT NOT NULL
+            );
+            """
+        )
+
+    def image_hashes(self, paths):
+        """Content hashes for paths; only files whose size/mtime changed are re-hashed."""
+        with self._lock:
+            cached = {
+                row[0]: row[1:]
+                for row in self.conn.execute("SELECT path, size, mtime_ns, image_hash FROM file_hashes")
+            }
+        hashes, updates = [], []
+
+        for p in paths:
+            st = p.stat()
+            hit = cached.get(str(p))
+            if hit and hit[0] == st.st_size and hit[1] == st.st_mtime_ns:
+                hashes.append(hit[2])
+                continue
+            digest = _file_sha1(p)
+            hashes.append(digest)
+            updates.append((str(p), st.st_size, st.st_mtime_ns, digest))
+
+        if updates:
+            with self._lock:
+                self.conn.executemany("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)", updates)
+                self.conn.commit()
+
+        return hashes
+
+    def get(self, version, hashes):
+        """Returns {image_hash: probs} for the hashes already scored by this version."""
+        found = {}
+        unique = list(set(hashes))
+        with self._lock:
+            for i in range(0, len(unique), 500):
+                chunk = unique[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT image_hash, probs FROM predictions "
+                    f"WHERE model_version = ? AND image_hash IN ({marks})",
+                    [version, *chunk],
+                )
+                for image_hash, blob in rows:
+                    found[image_hash] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put(self, version, hashes, probs):
+        rows = [(h, version, np.asarray(p, dtype=np.float32).tobytes()) for h, p in zip(hashes, probs)]
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)", rows)
+            self.conn.commit()
+
+    def versions(self):
+        with self._lock:
+            return [row[0] for row in self.conn.execute("SELECT DISTINCT model_version FROM predictions")]
+
+
+# -------------------------------------
+# METRICS
+# -------------------------------------
+def _list_test_images(test_dir: Path, class_names):
+    paths, labels = [], []
+    for label, class_name in enumerate(class_names):
+        class_dir = test_dir / class_name
+        if not class_dir.is_dir():
+            continue
+        for img_path in sorted(class_dir.iterdir()):
+            if img_path.is_file() and img_path.suffix.lower() in IMG_EXTS:
+                paths.append(img_path)
+                labels.append(label)
+    return paths, np.array(labels, dtype=np.int64)
+
+
+def compute_metrics(y_true, y_pred, class_names):
+    """Confusion matrix (rows = true, cols = predicted) and per-class precision/recall/F1."""
+    n = len(class_names)
+    cm = np.bincount(y_true * n + y_pred, minlength=n * n).reshape(n, n)
+
+    tp = np.diag(cm).astype(np.float64)
+    predicted = cm.sum(axis=0)
+    actual = cm.sum(axis=1)
+    precision = np.divide(tp, predicted, out=np.zeros(n), where=predicted > 0)
+    recall = np.divide(tp, actual, out=np.zeros(n), where=actual > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall,
+                   out=np.zeros(n), where=(precision + recall) > 0)
+
+    return {
+        "accuracy": float(tp.sum() / max(cm.sum(), 1)),
+        "confusion_matrix": cm.tolist(),
+        "per_class": {
+            name: {
+                "precision": round(float(precision[i]), 4),
+                "recall": round(float(recall[i]), 4),
+                "f1": round(float(f1[i]), 4),
+                "support": int(actual[i]),
+            }
+            for i, name in enumerate(class_names)
+        },
+    }
+
+
+# -------------------------------------
+# INCREMENTAL EVALUATION
+# -------------------------------------
+def _load_probs(store, version, hashes):
+    found = store.get(version, hashes)
+    missing = [i for i, h in enumerate(hashes) if h not in found]
+    return found, missing
+
+
+def evaluate(model, version, class_names, test_dir: Path = TEST_DIR, store=None, batch_size=32):
+    """
+    Evaluates `model` on test_dir, running inference only on images whose
+    content hash has no stored prediction for this model version.
+
+    Returns:
+        metrics dict (accuracy, confusion matrix, per-class scores, counts)
+    """
+    store = store or PredictionStore()
+    paths, y_true = _list_test_images(test_dir, class_names)
+    hashes = store.image_hashes(paths)
+
+    found, missing = _load_probs(store, version, hashes)
+
+    if missing:
+        print(f"📌 Scoring {len(missing)} new/changed images with model {version}")
+        ds = load_image_dataset([str(paths[i]) for i in missing], batch_size=batch_size)
+        probs = model.predict(ds, verbose=0)
+        new_hashes = [hashes[i] for i in missing]
+        store.put(version, new_hashes, probs)
+        found.update(zip(new_hashes, probs))
+
+    if not paths:
+        y_pred = np.zeros(0, dtype=np.int64)
+    else:
+        y_pred = np.array([int(np.argmax(found[h])) for h in hashes], dtype=np.int64)
+
+    metrics = compute_metrics(y_true, y_pred, class_names)
+    metrics.update({
+        "model_version": version,
+        "num_images": len(paths),
+        "newly_scored": len(set(hashes[i] for i in missing)),
+        "from_cache": len(paths) - len(missing),
+    })
+    return metrics
+
+
+def compare_versions(version_a, version_b, class_names, test_dir: Path = TEST_DIR, store=None):
+    """
+    Compares two model versions on the current test set using stored
+    predictions only (no inference). Both versions must have been evaluated.
+    """
+    store = store or PredictionStore()
+    paths, y_true = _list_test_images(test_dir, class_names)
+    hashes = store.image_hashes(paths)
+
+    results = {}
+    preds = {}
+    for version in (version_a, version_b):
+        found, missing = _load_probs(store, version, hashes)
+        if missing:
+            return {"error": f"{len(missing)} test images not yet evaluated with model {version}"}
+        preds[version] = np.array([int(np.argmax(found[h])) for h in hashes], dtype=np.int64)
+        results[version] = compute_metrics(y_true, preds[version], class_names)
+
+    a, b = results[version_a], results[version_b]
+    return {
+        "a": version_a,
+        "b": version_b,
+        "accuracy_a": a["accuracy"],
+        "accuracy_b": b["accuracy"],
+        "accuracy_delta": round(b["accuracy"] - a["accuracy"], 4),
+        "agreement": float(np.mean(preds[version_a] == preds[version_b])) if len(hashes) else 0.0,
+        "per_class_delta": {
+            name: {
+                metric: round(b["per_class"][name][metric] - a["per_class"][name][metric], 4)
+                for metric in ("precision", "recall", "f1")
+            }
+            for name in class_names
+        },
+    }
@@ -0,0 +1,253 @@
+# src/explain.py
+
+import base64
+import io
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from .preprocessing import IMG_SIZE, RESCALE, unwrap_preprocessing
+
+# -------------------------------------
+# EXPLAIN SETTINGS
+# -------------------------------------
+EXPLAIN_MAX_BATCH = int(os.getenv("DERMASCAN_EXPLAIN_MAX_BATCH", "8"))
+EXPLAIN_MAX_WAIT_MS = float(os.getenv("DERMASCAN_EXPLAIN_MAX_WAIT_MS", "20"))
+EXPLAIN_CACHE_SIZE = int(os.getenv("DERMASCAN_EXPLAIN_CACHE_SIZE", "512"))
+OVERLAY_ALPHA = 0.45
+OVERLAY_JPEG_QUALITY = 80
+
+
+# -------------------------------------
+# GRAD-CAM MODEL
+# -------------------------------------
+def build_gradcam_model(model):
+    """
+    Callable mapping a uint8 batch to (last conv feature map, class logits,
+    class probabilities), all from the same forward pass. Pass a
+    GradientTape to have the feature map watched.
+
+    The classifier's layers are re-applied one after another on a fresh
+    input instead of wiring a new keras.Model to their stored outputs:
+    when the backbone is a nested model (MobileNetV2 in the notebook), its
+    stored output belongs to the inner graph and cannot be connected to
+    the outer inputs. This assumes a linear stack of layers, as built in
+    the notebook. The final Dense layer is split so gradients are taken on
+    the pre-softmax logits, which do not saturate for confident predictions.
+    """
+    classifier = unwrap_preprocessing(model)
+    layers = [
+        layer for layer in classifier.layers
+        if not isinstance(layer, tf.keras.layers.InputLayer)
+    ]
+
+    head = layers[-1]
+    if not isinstance(head, tf.keras.layers.Dense):
+        raise ValueError(f"Grad-CAM needs a Dense output layer, got {type(head).__name__}")
+
+    conv_index = max(
+        i for i, layer in enumerate(layers) if len(layer.output.shape) == 4
+    )
+    backbone, pooling = layers[:conv_index + 1], layers[conv_index + 1:-1]
+
+    def forward(images, tape=None):
+        # Same rescale as the in-graph preprocessing layer
+        x = tf.cast(images, tf.float32) * RESCALE
+        for layer in backbone:
+            x = layer(x, training=False)
+        conv = x
+        if tape is not None:
+            # The backbone is usually frozen, so nothing upstream is watched
+            tape.watch(conv)
+        for layer in pooling:
+            x = layer(x, training=False)
+        logits = tf.matmul(x, head.kernel)
+        if head.use_bias:
+            logits = logits + head.bias
+        return conv, logits, head.activation(logits)
+
+    return forward
+
+
+def gradcam_batch(grad_model, images):
+    """
+    One forward + one backward pass over a uint8 batch.
+
+    The top-class logit summed over the batch has per-sample gradients
+    equal to each image's own top-class gradient, so a single
+    tape.gradient covers them all.
+
+    Returns:
+        probs (n, classes), heatmaps (n, H, W) in [0, 1] at input resolution
+    """
+    images = tf.convert_to_tensor(images, dtype=tf.uint8)
+
+    with tf.GradientTape() as tape:
+        conv, logits, probs = grad_model(images, tape=tape)
+        top = tf.argmax(logits, axis=1)
+        score = tf.reduce_sum(tf.gather(logits, top, axis=1, batch_dims=1))
+
+    grads = tape.gradient(score, conv)
+    weights = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+    cam = tf.nn.relu(tf.reduce_sum(weights * conv, axis=-1))
+    cam = cam / (tf.reduce_max(cam, axis=(1, 2), keepdims=True) + 1e-8)
+    cam = tf.image.resize(cam[..., tf.newaxis], IMG_SIZE)[..., 0]
+
+    return probs.numpy(), cam.numpy()
+
+
+# -------------------------------------
+# OVERLAY ENCODING
+# -------------------------------------
+def _jet(heatmap):
+    """Cheap jet-style colormap: (H, W) in [0, 1] → (H, W, 3) uint8."""
+    r = np.clip(1.5 - np.abs(4 * heatmap - 3), 0, 1)
+    g = np.clip(1.5 - np.abs(4 * heatmap - 2), 0, 1)
+    b = np.clip(1.5 - np.abs(4 * heatmap - 1), 0, 1)
+    return (np.stack([r, g, b], axis=-1) * 255).astype(np.uint8)
+
+
+def encode_overlay(image, heatmap, alpha=OVERLAY_ALPHA, quality=OVERLAY_JPEG_QUALITY):
+    """Blends the heatmap over the uint8 image and returns base64 JPEG."""
+    blended = (1 - alpha) * image.astype(np.float32) + alpha * _jet(heatmap)
+    buf = io.BytesIO()
+    Image.fromarray(blended.astype(np.uint8)).save(buf, format="JPEG", quality=quality)
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+# -------------------------------------
+# BATCHING + CACHE
+# -------------------------------------
+class GradCamExplainer:
+    """
+    Collects concurrent explanation requests for up to max_wait_ms (or
+    max_batch images) and runs them through gradcam_batch together on a
+    worker thread. Results are cached by (image hash, model version);
+    identical requests already in flight share one computation.
+    """
+
+    def __init__(
+        self,
+        model,
+        class_names,
+        max_batch=EXPLAIN_MAX_BATCH,
+        max_wait_ms=EXPLAIN_MAX_WAIT_MS,
+        cache_size=EXPLAIN_CACHE_SIZE,
+    ):
+        self.grad_model = build_gradcam_model(model)
+        self.class_names = class_names
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.cache_size = cache_size
+
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self.cache_hits = 0
+        self.batches = 0
+        self.explained = 0
+
+        self._thread = threading.Thread(target=self._run, name="gradcam", daemon=True)
+        self._thread.start()
+
+    def submit(self, key, img_array):
+        """
+        Args:
+            key: (image_hash, model_version)
+            img_array: uint8 array of shape (1, H, W, 3)
+
+        Returns:
+            concurrent.futures.Future resolving to the explanation dict
+        """
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                fut = Future()
+                fut.set_result({**self._cache[key], "cached": True})
+                return fut
+            if key in self._pending:
+                return self._pending[key]
+
+            fut = Future()
+            self._pending[key] = fut
+
+        self._queue.put((key, img_array[0]))
+        return fut
+
+    def _next_batch(self):
+        items = [self._queue.get()]
+        # One deadline from the first arrival, so no request waits longer
+        # than max_wait for the batch to fill
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._next_batch()
+            keys = [key for key, _ in items]
+            images = np.stack([img for _, img in items])
+
+            try:
+                probs, heatmaps = gradcam_batch(self.grad_model, images)
+                results = [
+                    self._result(p, img, cam) for p, img, cam in zip(probs, images, heatmaps)
+                ]
+            except Exception as e:
+                self._resolve(keys, error=e)
+                continue
+
+            self.batches += 1
+            self.explained += len(keys)
+            self._resolve(keys, results=results)
+
+    def _result(self, probs, image, heatmap):
+        class_index = int(np.argmax(probs))
+        return {
+            "class_name": self.class_names[class_index],
+            "confidence": float(probs[class_index]),
+            "heatmap_jpeg_base64": encode_overlay(image, heatmap),
+        }
+
+    def _resolve(self, keys, results=None, error=None):
+        with self._lock:
+            futures = [self._pending.pop(key) for key in keys]
+            if results is not None:
+                for key, result in zip(keys, results):
+                    self._cache[key] = result
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        for i, fut in enumerate(futures):
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result({**results[i], "cached": False})
+
+    def stats(self):
+        with self._lock:
+            cached = len(self._cache)
+        return {
+            "cached": cached,
+            "cache_hits": self.cache_hits,
+            "batches": self.batches,
+            "explained": self.explained,
+            "avg_batch_size": round(self.explained / max(self.batches, 1), 2),
+        }
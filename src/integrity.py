@@ -0,0 +1,215 @@
+# src/integrity.py
+#
+# Kept free of TensorFlow / numpy imports so worker processes start fast and
+# the top-level scripts (rename_images.py, prepare_dermascan_split.py) can
+# use it as a pre-step.
+
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+from PIL import Image
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+DATA_DIR = BASE_DIR / "data"
+
+DEFAULT_ROOTS = (DATA_DIR / "train", DATA_DIR / "test", DATA_DIR / "new_data")
+QUARANTINE_DIR = DATA_DIR / "quarantine"
+CACHE_PATH = DATA_DIR / ".integrity_cache.json"
+
+IMG_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+ALLOWED_FORMATS = {"JPEG", "PNG", "BMP"}   # what tf.io.decode_image can read
+ALLOWED_MODES = {"RGB"}
+MIN_SIDE = 32
+MAX_PIXELS = 50_000_000
+
+
+# -------------------------------------
+# SINGLE-FILE CHECK (runs in worker processes)
+# -------------------------------------
+def validate_image(path: str):
+    """
+    Header check, full decode, then mode / size checks.
+
+    Returns:
+        (path, None) if the image is usable, else (path, reason)
+    """
+    try:
+        with Image.open(path) as img:
+            fmt = img.format
+            img.verify()   # cheap header/structure check
+    except Exception as e:
+        return path, f"bad header: {e}"
+
+    if fmt not in ALLOWED_FORMATS:
+        return path, f"unsupported format: {fmt}"
+
+    try:
+        # verify() leaves the file unusable, so reopen for the full decode
+        with Image.open(path) as img:
+            img.load()
+            mode, (width, height) = img.mode, img.size
+    except Exception as e:
+        return path, f"decode failed: {e}"
+
+    if mode not in ALLOWED_MODES:
+        return path, f"non-RGB mode: {mode}"
+    if min(width, height) < MIN_SIDE:
+        return path, f"too small: {width}x{height}"
+    if width * height > MAX_PIXELS:
+        return path, f"too large: {width}x{height}"
+
+    return path, None
+
+
+# -------------------------------------
+# RESULT CACHE
+# -------------------------------------
+def _load_cache(cache_path: Path):
+    try:
+        return json.loads(Path(cache_path).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_cache(cache_path: Path, cache):
+    cache_path = Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache_path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(cache))
+    tmp.replace(cache_path)
+
+
+def _list_images(roots):
+    for root in roots:
+        root = Path(root)
+        if not root.exists():
+            continue
+        for img_path in root.rglob("*"):
+            if img_path.is_file() and img_path.suffix.lower() in IMG_EXTS:
+                yield img_path
+
+
+# -------------------------------------
+# QUARANTINE
+# -------------------------------------
+def _quarantine(path: Path, reason: str, quarantine_dir: Path):
+    """Moves a bad file out of the dataset, keeping root/class structure."""
+    try:
+        rel = path.resolve().relative_to(DATA_DIR)
+    except ValueError:
+        rel = Path(path.parent.name) / path.name
+
+    dest = Path(quarantine_dir) / rel
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    shutil.move(str(path), str(dest))
+
+    with open(Path(quarantine_dir) / "reasons.log", "a", encoding="utf-8") as f:
+        f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')}\t{rel}\t{reason}\n")
+
+    return dest
+
+
+# -------------------------------------
+# SCAN
+# -------------------------------------
+def scan_dataset(
+    roots=DEFAULT_ROOTS,
+    quarantine=True,
+    workers=None,
+    cache_path: Path = CACHE_PATH,
+    quarantine_dir: Path = QUARANTINE_DIR,
+):
+    """
+    Validates every image under roots using all CPU cores.
+
+    Results are cached by (path, size, mtime), so repeated scans only
+    decode new or modified files. Bad files are moved to quarantine_dir
+    (or only reported when quarantine=False).
+
+    Returns:
+        summary dict with counts and the list of bad files
+    """
+    start = time.perf_counter()
+    cache = _load_cache(cache_path)
+    fresh_cache = {}
+    to_check = {}
+    bad = {}
+
+    for img_path in _list_images(roots):
+        key = str(img_path.resolve())
+        st = img_path.stat()
+        hit = cache.get(key)
+        if hit and hit["size"] == st.st_size and hit["mtime_ns"] == st.st_mtime_ns:
+            fresh_cache[key] = hit
+            if hit["reason"]:
+                bad[key] = hit["reason"]
+        else:
+            to_check[key] = (st.st_size, st.st_mtime_ns)
+
+    if to_check:
+        workers = workers or os.cpu_count() or 1
+        chunksize = max(1, len(to_check) // (workers * 8))
+        # spawn: safe to call from a process that already runs TF threads
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+            for key, reason in pool.map(validate_image, list(to_check), chunksize=chunksize):
+                size, mtime_ns = to_check[key]
+                fresh_cache[key] = {"size": size, "mtime_ns": mtime_ns, "reason": reason}
+                if reason:
+                    bad[key] = reason
+
+    quarantined = []
+    if quarantine:
+        for key, reason in bad.items():
+            if not Path(key).exists():
+                continue
+            dest = _quarantine(Path(key), reason, quarantine_dir)
+            fresh_cache.pop(key, None)
+            quarantined.append(str(dest))
+            print(f"   🚫 Quarantined {key}: {reason}")
+
+    # Merge into the existing cache: entries outside the scanned roots are
+    # kept; entries under them whose files are gone (or were quarantined) go.
+    scanned_roots = [str(Path(root).resolve()) + os.sep for root in roots]
+    merged = {
+        key: entry
+        for key, entry in cache.items()
+        if not any(key.startswith(root) for root in scanned_roots)
+    }
+    merged.update(fresh_cache)
+    _save_cache(cache_path, merged)
+
+    return {
+        "scanned": len(fresh_cache) + len(quarantined),
+        "checked": len(to_check),
+        "from_cache": len(fresh_cache) + len(quarantined) - len(to_check),
+        "bad": len(bad),
+        "bad_files": [{"path": k, "reason": r} for k, r in bad.items()],
+        "quarantined": len(quarantined),
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+def print_summary(summary):
+    print(f"🔎 Integrity scan: {summary['scanned']} images "
+          f"({summary['checked']} checked, {summary['from_cache']} cached) "
+          f"in {summary['seconds']}s — {summary['bad']} bad, "
+          f"{summary['quarantined']} quarantined")
+
+
+if __name__ == "__main__":
+    # ---- HOW TO CALL IT ----
+    #   python -m src.integrity                     (train/, test/, new_data/)
+    #   python -m src.integrity data/IMG_CLASSES --dry-run
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    roots = [Path(a) for a in args] or DEFAULT_ROOTS
+
+    summary = scan_dataset(roots, quarantine="--dry-run" not in sys.argv)
+    for item in summary["bad_files"]:
+        print(f"   ❌ {item['path']}: {item['reason']}")
+    print_summary(summary)
@@ -1,8 +1,14 @@
 # src/model.py
 
+import json
+import shutil
+import time
+import numpy as np
 import tensorflow as tf
 from pathlib import Path
 
+from .preprocessing import with_preprocessing, measure_throughput
+
 # -------------------------------------
 # MODEL LOADING
 # -------------------------------------
@@ -11,34 +17,178 @@ def get_model(model_path: str = "models/dermascan_base.h5"):
     """
     Loads the model from the given .h5 path.
     If running first time, it loads the base pretrained model.
+    The returned model takes uint8 images and rescales them in-graph.
     """
     model_path = Path(__file__).resolve().parents[1] / model_path
 
     print(f"📌 Loading model from: {model_path}")
 
-    model = tf.keras.models.load_model(model_path)
+    model = with_preprocessing(tf.keras.models.load_model(model_path))
     model.trainable = True  # ensure layers are trainable for fine-tuning
 
     return model
 
 
+# -------------------------------------
+# CHECKPOINTING / EARLY STOPPING
+# -------------------------------------
+CHECKPOINT_DIR = "models/checkpoints/retrain"
+
+# Input pipeline should outrun training by this factor to keep the CPU busy
+INPUT_HEADROOM = 1.2
+
+
+class EpochTimer(tf.keras.callbacks.Callback):
+    """
+    Records wall-clock seconds per epoch so skipped epochs can be costed,
+    plus training steps and seconds before validation starts, so the
+    training step rate can be compared with the input pipeline's.
+    """
+
+    def on_train_begin(self, logs=None):
+        self.epoch_seconds = []
+        self.train_seconds = []
+        self.train_steps = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.perf_counter()
+        self._train_end = None
+        self._steps = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._steps += 1
+
+    def on_test_begin(self, logs=None):
+        if self._train_end is None:
+            self._train_end = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        now = time.perf_counter()
+        self.epoch_seconds.append(now - self._start)
+        self.train_seconds.append((self._train_end or now) - self._start)
+        self.train_steps.append(self._steps)
+
+    def images_per_sec(self, batch_size):
+        seconds = sum(self.train_seconds)
+        return round(sum(self.train_steps) * batch_size / seconds, 1) if seconds > 0 else 0.0
+
+
+class EarlyStoppingState(tf.keras.callbacks.Callback):
+    """
+    Persists what BackupAndRestore does not: the EarlyStopping counters,
+    its best weights and the full val_accuracy history. On resume they are
+    loaded back into the EarlyStopping callback, so the patience window and
+    restore_best_weights span the whole run, not just the resumed part.
+
+    Must be placed after the EarlyStopping callback in the callback list.
+    State is only restored when `resume` is True (BackupAndRestore has a
+    backup to resume from); otherwise leftovers of a crashed run are removed.
+    """
+
+    def __init__(self, early_stopping, state_dir: Path, resume=False):
+        super().__init__()
+        self.early_stopping = early_stopping
+        self.state_dir = Path(state_dir)
+        self.resume = resume
+        self.val_accuracy = []
+
+    @property
+    def _state_file(self):
+        return self.state_dir / "state.json"
+
+    @property
+    def _weights_file(self):
+        return self.state_dir / "best_weights.npz"
+
+    def on_train_begin(self, logs=None):
+        # Runs after EarlyStopping.on_train_begin has reset its counters
+        self.val_accuracy = []
+        if not self.resume:
+            # State without a backup would restart a fresh run mid-patience
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+            return
+        if not self._state_file.exists():
+            return
+
+        state = json.loads(self._state_file.read_text())
+        self.val_accuracy = state["val_accuracy"]
+        es = self.early_stopping
+        es.best = state["best"]
+        es.wait = state["wait"]
+        if hasattr(es, "best_epoch"):
+            es.best_epoch = state["best_epoch"]
+        if self._weights_file.exists():
+            with np.load(self._weights_file) as data:
+                es.best_weights = [data[f"w{i}"] for i in range(len(data.files))]
+        print(f"♻️ Restored early-stopping state (best val_accuracy={es.best:.4f}, wait={es.wait})")
+
+    def on_epoch_end(self, epoch, logs=None):
+        # Runs after EarlyStopping.on_epoch_end has updated best / wait
+        self.val_accuracy.append(float((logs or {}).get("val_accuracy", 0.0)))
+        es = self.early_stopping
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+
+        if es.best_weights is not None and es.wait == 0:
+            tmp = self.state_dir / "best_weights.tmp.npz"
+            np.savez(tmp, **{f"w{i}": w for i, w in enumerate(es.best_weights)})
+            tmp.replace(self._weights_file)
+
+        state = {
+            "val_accuracy": self.val_accuracy,
+            "best": float(es.best) if es.best is not None else None,
+            "wait": int(es.wait),
+            "best_epoch": int(getattr(es, "best_epoch", 0) or 0),
+        }
+        tmp = self.state_dir / "state.tmp.json"
+        tmp.write_text(json.dumps(state))
+        tmp.replace(self._state_file)
+
+    def on_train_end(self, logs=None):
+        # Mirrors BackupAndRestore: a finished run leaves nothing to resume
+        shutil.rmtree(self.state_dir, ignore_errors=True)
+
+
 # -------------------------------------
 # FINE-TUNING LOGIC
 # -------------------------------------
 
-def fine_tune(model, train_ds, val_ds, model_path="models/dermascan_retrained.h5", epochs=5):
+def fine_tune(
+    model,
+    train_ds,
+    val_ds,
+    model_path="models/dermascan_retrained.h5",
+    epochs=5,
+    patience=2,
+    min_delta=1e-3,
+    checkpoint_dir=CHECKPOINT_DIR,
+    batch_size=32,
+    measure_input=True,
+):
     """
     Fine-tune the model using combined training data.
-    
+
+    A checkpoint (weights + optimizer state) is written after every epoch,
+    together with the early-stopping state and best weights.
+    If a previous run was interrupted, training resumes from the last
+    completed epoch instead of starting over. Training stops early once
+    val_accuracy has not improved by min_delta for `patience` epochs
+    (counted across the interruption), and the best weights are kept.
+
     Args:
         model: the loaded Keras model
         train_ds: the training dataset
         val_ds: validation dataset
         model_path: where to save retrained model
-        epochs: number of epochs to fine-tune
+        epochs: maximum number of epochs to fine-tune
+        patience: epochs without val_accuracy improvement before stopping
+        min_delta: smallest val_accuracy change counted as improvement
+        checkpoint_dir: where in-progress checkpoints are kept
+        batch_size: batch size of train_ds, to turn steps into images/sec
+        measure_input: time the input pipeline alone before training, so
+                       its images/sec can be compared with training's
 
     Returns:
-        model, history
+        model, history, report
     """
 
     print("🔧 Starting fine-tuning...")
@@ -50,13 +200,46 @@ def fine_tune(model, train_ds, val_ds, model_path="models/dermascan_retrained.h5
         metrics=["accuracy"]
     )
 
+    backup_path = Path(__file__).resolve().parents[1] / checkpoint_dir
+    resuming = backup_path.exists() and any(backup_path.iterdir())
+    if resuming:
+        print(f"♻️ Resuming from checkpoint in: {backup_path}")
+
+    timer = EpochTimer()
+    early_stopping = tf.keras.callbacks.EarlyStopping(
+        monitor="val_accuracy",
+        mode="max",
+        patience=patience,
+        min_delta=min_delta,
+        restore_best_weights=True,
+    )
+    es_state = EarlyStoppingState(
+        early_stopping,
+        backup_path.parent / f"{backup_path.name}_early_stopping",
+        resume=resuming,
+    )
+    callbacks = [
+        # Restores model + optimizer state and epoch counter after a crash;
+        # the backup is removed automatically when training finishes.
+        tf.keras.callbacks.BackupAndRestore(str(backup_path), save_freq="epoch"),
+        early_stopping,
+        es_state,
+        timer,
+    ]
+
+    # Input pipeline speed without the model attached
+    pipeline = measure_throughput(train_ds, num_batches=20, warmup_batches=2) if measure_input else None
+
     # Train
+    start = time.perf_counter()
     history = model.fit(
         train_ds,
         validation_data=val_ds,
         epochs=epochs,
+        callbacks=callbacks,
         verbose=1
     )
+    elapsed = time.perf_counter() - start
 
     # Save retrained model
     save_path = Path(__file__).resolve().parents[1] / model_path
@@ -65,6 +248,40 @@ def fine_tune(model, train_ds, val_ds, model_path="models/dermascan_retrained.h5
     save_path.parent.mkdir(parents=True, exist_ok=True)
     model.save(save_path)
 
-    print("✅ Fine-tuning complete")
+    # Compare with the fixed schedule of `epochs` epochs. Epochs skipped by
+    # resuming after a crash are reported separately from early stopping.
+    last_epoch = history.epoch[-1] + 1 if history.epoch else 0
+    resumed_from = history.epoch[0] if history.epoch else 0
+    epochs_saved = max(0, epochs - last_epoch)
+    avg_epoch = (
+        sum(timer.epoch_seconds) / len(timer.epoch_seconds) if timer.epoch_seconds else 0.0
+    )
+    val_history = es_state.val_accuracy
+    pipeline_ips = pipeline["images_per_sec"] if pipeline else None
+    train_ips = timer.images_per_sec(batch_size)
+
+    report = {
+        "max_epochs": epochs,
+        "epochs_completed": last_epoch,
+        "epochs_run_this_session": len(history.epoch),
+        "resumed_from_epoch": resumed_from,
+        "stopped_early": early_stopping.stopped_epoch > 0,
+        "val_accuracy_history": val_history,
+        "best_val_accuracy": max(val_history) if val_history else None,
+        "epochs_saved": epochs_saved,
+        "wall_clock_seconds": round(elapsed, 1),
+        "estimated_seconds_saved": round(epochs_saved * avg_epoch, 1),
+        "epochs_recovered": resumed_from,
+        "estimated_seconds_recovered": round(resumed_from * avg_epoch, 1),
+        "pipeline_images_per_sec": pipeline_ips,
+        "train_images_per_sec": train_ips,
+        "input_bound": pipeline_ips is not None and pipeline_ips < INPUT_HEADROOM * train_ips,
+    }
+
+    if report["input_bound"]:
+        print(f"⚠️ Input pipeline ({pipeline_ips} img/s) barely outruns training "
+              f"({train_ips} img/s) — the CPU input side may be the bottleneck.")
+
+    print(f"✅ Fine-tuning complete — {report}")
 
-    return model, history
+    return model, history, report
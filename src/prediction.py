@@ -1,12 +1,19 @@
 # src/prediction.py
 
 import numpy as np
+import tensorflow as tf
 from tensorflow.keras.models import load_model
 from tensorflow.keras.preprocessing import image
 from pathlib import Path
 import io
 from PIL import Image
 
+from .preprocessing import (
+    with_preprocessing,
+    decode_and_resize,
+    resize_to_uint8,
+)
+
 BASE_DIR = Path(__file__).resolve().parents[1]
 MODEL_PATH = BASE_DIR / "models" / "dermascan_base.h5"
 
@@ -19,23 +26,40 @@ def get_model():
     Called by API at startup.
     """
     print(f"Loading model from: {MODEL_PATH}")
-    model = load_model(MODEL_PATH)
+    model = with_preprocessing(load_model(MODEL_PATH))
     return model
 
 
 # ---------------------------
 # IMAGE PREPROCESSING
 # ---------------------------
-def preprocess_image(img: Image.Image):
+def preprocess_bytes(img_bytes: bytes):
     """
-    Preprocess a PIL Image object:
-    - Normalize
+    Preprocess uploaded image bytes with the exact decode + resize the
+    training pipeline uses:
+    - Decode to RGB
+    - Resize
     - Expand batch dimension
+    Returns a uint8 array; rescaling to 0-1 happens inside the model.
+
+    tf.io.decode_image reads JPEG, PNG, BMP and GIF. Other formats PIL
+    can open (e.g. WEBP, TIFF) are decoded with PIL and go through the
+    same resize.
     """
-    img = img.resize((256, 256))
-    img_array = np.array(img).astype("float32") / 255.0
-    img_array = np.expand_dims(img_array, axis=0)
-    return img_array
+    try:
+        img_array = decode_and_resize(img_bytes).numpy()
+    except tf.errors.InvalidArgumentError:
+        return preprocess_image(Image.open(io.BytesIO(img_bytes)))
+    return np.expand_dims(img_array, axis=0)
+
+
+def preprocess_image(img: Image.Image):
+    """
+    Same as preprocess_bytes for an already-decoded PIL Image object.
+    """
+    img_array = np.asarray(img.convert("RGB"), dtype=np.uint8)
+    img_array = resize_to_uint8(img_array).numpy()
+    return np.expand_dims(img_array, axis=0)
 
 
 # ---------------------------
@@ -52,11 +76,8 @@ def predict_from_bytes(model, img_bytes: bytes, class_names: list):
     }
     """
 
-    # Load image
-    img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-
-    # Preprocess
-    img_array = preprocess_image(img)
+    # Decode + preprocess
+    img_array = preprocess_bytes(img_bytes)
 
     # Predict
     preds = model.predict(img_array)
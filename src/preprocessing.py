@@ -1,5 +1,7 @@
 # src/preprocessing.py
 
+import os
+import time
 import tensorflow as tf
 from pathlib import Path
 
@@ -15,79 +17,406 @@ NEW_DATA_DIR = DATA_DIR / "new_data"   # holds uploaded training images
 
 
 # -------------------------------------
-# BASE DATASET LOADING
+# SHARED PREPROCESSING (serving + training)
 # -------------------------------------
-def load_train_test_datasets(img_size=(256, 256), batch_size=32):
+IMG_SIZE = (256, 256)
+
+# Single definition of the pixel rescaling (MobileNet expects values 0-1).
+# It lives inside the model graph, so every caller feeds raw uint8 pixels.
+RESCALE = 1.0 / 255.0
+RESCALE_LAYER_NAME = "rescale_uint8"
+
+
+def with_preprocessing(model, img_size=IMG_SIZE):
     """
-    Loads the pre-split train/ and test/ folders
+    Returns a model that takes uint8 images of shape (H, W, 3) and rescales
+    them in-graph before calling `model`. Models that already take uint8
+    input (e.g. a saved retrained model) are returned unchanged.
+    """
+    if model.inputs and model.inputs[0].dtype == tf.uint8:
+        return model
+
+    inputs = tf.keras.Input(shape=(*img_size, 3), dtype=tf.uint8, name="image")
+    x = tf.keras.layers.Rescaling(RESCALE, name=RESCALE_LAYER_NAME)(inputs)
+    outputs = model(x)
+    return tf.keras.Model(inputs, outputs, name=f"{model.name}_uint8")
+
+
+def resize_to_uint8(img, img_size=IMG_SIZE):
+    """
+    Single definition of the pixel values every model input is built from:
+    bilinear resize (what the base model was trained with via
+    image_dataset_from_directory), then round to uint8.
+    Works on one (H, W, 3) image or a batch.
+    """
+    img = tf.image.resize(img, img_size, method="bilinear")
+    # Bilinear weights sum to 1, so values stay within 0-255: no clip needed
+    # (it would be one more float32 copy of the image per request)
+    return tf.cast(tf.round(img), tf.uint8)
+
+
+def decode_and_resize(raw, img_size=IMG_SIZE):
+    """Encoded image bytes → (H, W, 3) uint8, shared by serving and training."""
+    img = tf.io.decode_image(raw, channels=3, expand_animations=False)
+    img = resize_to_uint8(img, img_size)
+    img.set_shape((*img_size, 3))
+    return img
+
+
+def unwrap_preprocessing(model):
+    """The float-input classifier inside a with_preprocessing() model."""
+    layer_names = [layer.name for layer in model.layers]
+    if RESCALE_LAYER_NAME in layer_names and isinstance(model.layers[-1], tf.keras.Model):
+        return model.layers[-1]
+    return model
+
+
+# -------------------------------------
+# STREAMING PIPELINE SETTINGS
+# -------------------------------------
+AUTOTUNE = tf.data.AUTOTUNE
+IMG_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+# Upper bound on RAM the input pipeline may use for buffering (prefetch + autotune)
+PIPELINE_RAM_MB = int(os.getenv("DERMASCAN_PIPELINE_RAM_MB", "1024"))
+
+# Upper bound on the share of each retraining batch drawn from data/new_data
+NEW_DATA_WEIGHT = float(os.getenv("DERMASCAN_NEW_DATA_WEIGHT", "0.3"))
+
+# Max times each new image is expected to be seen per epoch (oversampling cap)
+MAX_NEW_DATA_REPEATS = float(os.getenv("DERMASCAN_MAX_NEW_DATA_REPEATS", "3"))
+
+
+# -------------------------------------
+# FILE LISTING
+# -------------------------------------
+def get_class_names(root_dir: Path = TRAIN_DIR):
+    """
+    Class names in the same (alphabetical) order image_dataset_from_directory uses,
+    so label indices stay compatible with the trained model.
+    """
+    return sorted(d.name for d in root_dir.iterdir() if d.is_dir())
+
+
+def list_labelled_files(root_dir: Path, class_names):
+    """
+    Collects (path, label_index) pairs for every image under root_dir/<class>/.
+    Folders that are not in class_names are ignored.
+    """
+    paths, labels = [], []
+
+    for label, class_name in enumerate(class_names):
+        class_dir = root_dir / class_name
+        if not class_dir.is_dir():
+            continue
+
+        for img_path in sorted(class_dir.iterdir()):
+            if img_path.is_file() and img_path.suffix.lower() in IMG_EXTS:
+                paths.append(str(img_path))
+                labels.append(label)
+
+    return paths, labels
+
+
+# -------------------------------------
+# PER-IMAGE DECODE / BATCH-LEVEL AUGMENT
+# -------------------------------------
+def _read_file(path, label):
+    """Reads raw bytes; used inside interleave so several files are read concurrently."""
+    return tf.data.Dataset.from_tensors((tf.io.read_file(path), label))
+
+
+def _decode(img_size):
+    def decode(raw, label):
+        return decode_and_resize(raw, img_size), label
+
+    return decode
+
+
+def _augment(num_classes, augment):
+    def transform(images, labels):
+        if augment:
+            # Vectorized over the whole batch, independent randomness per image.
+            # Stays in 0-255 pixel space; rescaling happens inside the model.
+            images = tf.image.random_flip_left_right(images)
+            images = tf.image.random_flip_up_down(images)
+            images = tf.cast(images, tf.float32)
+            batch = tf.shape(images)[0]
+            brightness = tf.random.uniform((batch, 1, 1, 1), -25.5, 25.5)
+            contrast = tf.random.uniform((batch, 1, 1, 1), 0.9, 1.1)
+            mean = tf.reduce_mean(images, axis=[1, 2, 3], keepdims=True)
+            images = (images - mean) * contrast + mean + brightness
+            images = tf.cast(tf.round(tf.clip_by_value(images, 0.0, 255.0)), tf.uint8)
+
+        return images, tf.one_hot(labels, num_classes)
+
+    return transform
+
+
+def _pipeline_options(ram_mb):
+    options = tf.data.Options()
+    options.autotune.enabled = True
+    options.autotune.ram_budget = int(ram_mb) * 1024 * 1024
+    options.deterministic = False
+    return options
+
+
+def _prefetch_batches(img_size, batch_size, ram_mb):
+    """Number of decoded uint8 batches that fit in a quarter of the RAM budget."""
+    batch_bytes = batch_size * img_size[0] * img_size[1] * 3
+    return max(1, (int(ram_mb) * 1024 * 1024 // 4) // batch_bytes)
+
+
+# -------------------------------------
+# STREAMING TRAINING PIPELINE
+# -------------------------------------
+def stream_image_dataset(root_dir: Path, class_names, img_size=IMG_SIZE, repeat=False):
+    """
+    Unbatched stream of (uint8 image, int label) from root_dir.
+    Only the file list is shuffled (re-shuffled every epoch), so memory
+    stays flat no matter how large the dataset is.
+
     Returns:
-        train_ds, test_ds, class_names
+        dataset  OR  None if no images exist
     """
+    paths, labels = list_labelled_files(root_dir, class_names)
+    if not paths:
+        return None
 
-    print("📌 Loading train dataset from:", TRAIN_DIR)
-    train_ds = tf.keras.utils.image_dataset_from_directory(
-        TRAIN_DIR,
-        image_size=img_size,
-        batch_size=batch_size,
-        label_mode="categorical",
-        shuffle=True,
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    ds = ds.shuffle(len(paths), reshuffle_each_iteration=True)
+    if repeat:
+        ds = ds.repeat()
+
+    ds = ds.interleave(
+        _read_file,
+        cycle_length=8,
+        num_parallel_calls=AUTOTUNE,
+        deterministic=False,
     )
+    ds = ds.map(_decode(img_size), num_parallel_calls=AUTOTUNE, deterministic=False)
 
-    print("📌 Loading test dataset from:", TEST_DIR)
-    test_ds = tf.keras.utils.image_dataset_from_directory(
-        TEST_DIR,
-        image_size=img_size,
-        batch_size=batch_size,
-        label_mode="categorical",
-        shuffle=False,
+    return ds
+
+
+def build_training_pipeline(
+    sources,
+    class_names,
+    img_size=IMG_SIZE,
+    batch_size=32,
+    weights=None,
+    augment=True,
+    ram_mb=PIPELINE_RAM_MB,
+):
+    """
+    Builds a bounded-memory training dataset from one or more image folders.
+
+    Args:
+        sources: list of root folders (e.g. [TRAIN_DIR, NEW_DATA_DIR])
+        class_names: label order shared by every source
+        weights: sampling weight per source. The first source defines the
+                 epoch length; the others are repeated and mixed in.
+        augment: apply random flips / brightness / contrast per batch
+        ram_mb: memory ceiling for buffering inside the pipeline
+
+    Returns:
+        dataset  OR  None if the first source has no images
+    """
+    streams = []
+    for i, root in enumerate(sources):
+        stream = stream_image_dataset(root, class_names, img_size, repeat=i > 0)
+        if stream is None:
+            if i == 0:
+                return None
+            print(f"⚠️ No images in {root}, skipping it.")
+            continue
+        streams.append((stream, weights[i] if weights else 1.0))
+
+    if len(streams) == 1:
+        ds = streams[0][0]
+    else:
+        total = sum(w for _, w in streams)
+        ds = tf.data.Dataset.sample_from_datasets(
+            [s for s, _ in streams],
+            weights=[w / total for _, w in streams],
+            stop_on_empty_dataset=True,
+        )
+
+    ds = ds.batch(batch_size, num_parallel_calls=AUTOTUNE, deterministic=False)
+    ds = ds.map(
+        _augment(len(class_names), augment),
+        num_parallel_calls=AUTOTUNE,
+        deterministic=False,
     )
+    ds = ds.prefetch(_prefetch_batches(img_size, batch_size, ram_mb))
+
+    return ds.with_options(_pipeline_options(ram_mb))
 
-    class_names = train_ds.class_names
-    print("📌 Classes detected:", class_names)
 
-    # Normalize (MobileNet expects values 0-1)
-    train_ds = train_ds.map(lambda x, y: (x / 255.0, y))
-    test_ds = test_ds.map(lambda x, y: (x / 255.0, y))
+def measure_throughput(ds, num_batches=50, warmup_batches=5):
+    """
+    Iterates the pipeline without a model attached and reports images/sec.
+    If this number is well above the model's training speed, the CPU input
+    side is not the bottleneck.
+    """
+    images = 0
+    it = iter(ds)
 
-    # Cache + prefetch for performance
-    train_ds = train_ds.cache().prefetch(tf.data.AUTOTUNE)
-    test_ds = test_ds.cache().prefetch(tf.data.AUTOTUNE)
+    for _ in range(warmup_batches):
+        next(it, None)
 
-    return train_ds, test_ds, class_names
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        batch = next(it, None)
+        if batch is None:
+            break
+        images += int(tf.shape(batch[0])[0])
+    elapsed = time.perf_counter() - start
+
+    return {
+        "images": images,
+        "seconds": round(elapsed, 3),
+        "images_per_sec": round(images / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+
+def load_image_dataset(paths, img_size=IMG_SIZE, batch_size=32):
+    """
+    Deterministic, unshuffled batches of uint8 images for inference
+    over a fixed list of files (embeddings, evaluation). Order matches paths.
+    """
+    ds = tf.data.Dataset.from_tensor_slices((list(paths), [0] * len(paths)))
+    ds = ds.map(
+        lambda p, y: (tf.io.read_file(p), y),
+        num_parallel_calls=AUTOTUNE,
+    )
+    decode = _decode(img_size)
+    ds = ds.map(lambda x, y: decode(x, y)[0], num_parallel_calls=AUTOTUNE)
+    return ds.batch(batch_size).prefetch(AUTOTUNE)
 
 
 # -------------------------------------
-# NEW DATASET LOADING (RETRAINING)
+# BASE DATASET LOADING
 # -------------------------------------
-def load_new_data_dataset(img_size=(256, 256), batch_size=32):
+def has_base_data():
+    """True if data/train/ contains at least one image (nothing is decoded)."""
+    return TRAIN_DIR.exists() and any(
+        p.suffix.lower() in IMG_EXTS for p in TRAIN_DIR.glob("*/*")
+    )
+
+
+def load_test_dataset(class_names=None, img_size=IMG_SIZE, batch_size=32):
     """
-    Loads new images uploaded to data/new_data/
-    These images will be used to retrain the model.
-    
+    Batches of (uint8 image, one-hot label) from the pre-split test/ folder,
+    used as validation data during retraining.
+    """
+    class_names = class_names or get_class_names(TRAIN_DIR)
+
+    print("📌 Loading test dataset from:", TEST_DIR)
+    test_paths, test_labels = list_labelled_files(TEST_DIR, class_names)
+    if not test_paths:
+        raise ValueError(f"No images found in {TEST_DIR}")
+
+    # Same decode + resize as serving and training; the model rescales in-graph
+    decode = _decode(img_size)
+    num_classes = len(class_names)
+    test_ds = tf.data.Dataset.from_tensor_slices((test_paths, test_labels))
+    test_ds = test_ds.map(
+        lambda p, y: decode(tf.io.read_file(p), tf.one_hot(y, num_classes)),
+        num_parallel_calls=AUTOTUNE,
+    ).batch(batch_size)
+
+    # Test set is small and fixed, so it is safe to cache
+    return test_ds.cache().prefetch(AUTOTUNE)
+
+
+def load_train_test_datasets(img_size=IMG_SIZE, batch_size=32):
+    """
+    Loads the pre-split train/ and test/ folders
     Returns:
-        new_ds  OR  None if no data exists
+        train_ds, test_ds, class_names
     """
 
+    class_names = get_class_names(TRAIN_DIR)
+    print("📌 Classes detected:", class_names)
+
+    print("📌 Streaming train dataset from:", TRAIN_DIR)
+    train_ds = build_training_pipeline(
+        [TRAIN_DIR], class_names, img_size=img_size, batch_size=batch_size
+    )
+    test_ds = load_test_dataset(class_names, img_size=img_size, batch_size=batch_size)
+
+    return train_ds, test_ds, class_names
+
+
+# -------------------------------------
+# NEW DATASET LOADING (RETRAINING)
+# -------------------------------------
+def has_new_data():
+    """True if data/new_data/ contains at least one image."""
     if not NEW_DATA_DIR.exists():
         print("⚠️ No new_data/ directory found.")
-        return None
+        return False
 
-    # Check if directory has any files
-    if not any(NEW_DATA_DIR.glob("*/*")):
+    if not any(p.suffix.lower() in IMG_EXTS for p in NEW_DATA_DIR.glob("*/*")):
         print("⚠️ No new images to retrain on.")
+        return False
+
+    return True
+
+
+def new_data_share(n_base, n_new, max_share=NEW_DATA_WEIGHT, max_repeats=MAX_NEW_DATA_REPEATS):
+    """
+    Sampling weight for new data, based on the source sizes.
+
+    The epoch ends when the base set is exhausted, so with share w each new
+    image is seen about  w / (1 - w) * n_base / n_new  times per epoch.
+    The share is the smaller of max_share and the value that keeps this at
+    max_repeats, so a handful of uploads is not replayed thousands of times.
+    """
+    if n_new == 0:
+        return 0.0
+    if n_base == 0:
+        return 1.0
+    capped = max_repeats * n_new / (n_base + max_repeats * n_new)
+    return min(max_share, capped)
+
+
+def load_retrain_dataset(img_size=IMG_SIZE, batch_size=32, new_data_weight=None):
+    """
+    Mixes base training data and uploaded new data by weighted sampling,
+    so every batch contains new images instead of them all landing at the
+    end of the epoch. By default the weight comes from new_data_share().
+
+    Returns:
+        mixed_ds  OR  None if no new data exists
+    """
+
+    if not has_new_data():
         return None
 
-    print("📌 Loading NEW retraining data from:", NEW_DATA_DIR)
+    class_names = get_class_names(TRAIN_DIR)
+    if new_data_weight is None:
+        n_base = len(list_labelled_files(TRAIN_DIR, class_names)[0])
+        n_new = len(list_labelled_files(NEW_DATA_DIR, class_names)[0])
+        new_data_weight = new_data_share(n_base, n_new)
+
+    print(f"📌 Mixing {TRAIN_DIR} and {NEW_DATA_DIR} (new data weight={new_data_weight:.3f})")
 
-    new_ds = tf.keras.utils.image_dataset_from_directory(
-        NEW_DATA_DIR,
-        image_size=img_size,
+    return build_training_pipeline(
+        [TRAIN_DIR, NEW_DATA_DIR],
+        class_names,
+        img_size=img_size,
         batch_size=batch_size,
-        label_mode="categorical",
-        shuffle=True,
+        weights=[1.0 - new_data_weight, new_data_weight],
     )
 
-    new_ds = new_ds.map(lambda x, y: (x / 255.0, y))
-    new_ds = new_ds.cache().prefetch(tf.data.AUTOTUNE)
 
-    return new_ds
+if __name__ == "__main__":
+    # ---- HOW TO CALL IT ----
+    #   python -m src.preprocessing
+    # Prints input pipeline throughput so it can be compared with training speed.
+    ds = load_retrain_dataset() or build_training_pipeline([TRAIN_DIR], get_class_names(TRAIN_DIR))
+    stats = measure_throughput(ds)
+    print(f"🚀 Pipeline throughput: {stats['images_per_sec']} images/sec "
+          f"({stats['images']} images in {stats['seconds']}s)")
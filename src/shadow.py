@@ -0,0 +1,167 @@
+# src/shadow.py
+
+import os
+import queue
+import random
+import threading
+import time
+import numpy as np
+
+# -------------------------------------
+# SHADOW SETTINGS
+# -------------------------------------
+SHADOW_SAMPLE_RATE = float(os.getenv("DERMASCAN_SHADOW_SAMPLE_RATE", "0.1"))
+SHADOW_QUEUE_SIZE = int(os.getenv("DERMASCAN_SHADOW_QUEUE_SIZE", "256"))
+SHADOW_BATCH_SIZE = 16
+
+# Max fraction of wall-clock time the shadow worker spends computing. TF op
+# thread pools are shared process-wide, so the worker cannot be given fewer
+# threads than serving; instead it idles after each batch for long enough
+# to keep its share of the CPU under this bound.
+SHADOW_MAX_DUTY = float(os.getenv("DERMASCAN_SHADOW_MAX_DUTY", "0.25"))
+
+
+class ShadowRunner:
+    """
+    Scores a candidate model on a sample of live /predict inputs, off the
+    request path. submit() never blocks: when the queue is full the sample
+    is dropped and counted. A single background thread drains the queue
+    in batches, at most max_duty of the time, and aggregates agreement
+    with the serving model.
+    """
+
+    def __init__(
+        self,
+        candidate_model,
+        candidate_version,
+        class_names,
+        sample_rate=SHADOW_SAMPLE_RATE,
+        queue_size=SHADOW_QUEUE_SIZE,
+        batch_size=SHADOW_BATCH_SIZE,
+        max_duty=SHADOW_MAX_DUTY,
+    ):
+        self.candidate = candidate_model
+        self.candidate_version = candidate_version
+        self.class_names = class_names
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.max_duty = max_duty
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="shadow-inference", daemon=True)
+        self._reset_stats()
+
+    def _reset_stats(self):
+        n = len(self.class_names)
+        self.submitted = 0
+        self.dropped = 0
+        self.scored = 0
+        self.agreed = 0
+        self.confidence_shift_sum = 0.0
+        self.abs_confidence_shift_sum = 0.0
+        self.batches = 0
+        self.batch_seconds = 0.0
+        # rows = serving class, cols = candidate class
+        self.confusion = np.zeros((n, n), dtype=np.int64)
+
+    # ---------- lifecycle ----------
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    # ---------- request path ----------
+    def submit(self, img_array, serving_probs):
+        """
+        Offers one preprocessed input (batch of 1) and the serving model's
+        softmax output. Returns immediately whether or not it was queued.
+        """
+        if random.random() >= self.sample_rate:
+            return False
+        try:
+            self._queue.put_nowait((img_array[0], np.asarray(serving_probs)))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    # ---------- background worker ----------
+    def _next_batch(self):
+        try:
+            items = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        while len(items) < self.batch_size:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while not self._stop.is_set():
+            items = self._next_batch()
+            if not items:
+                continue
+
+            start = time.perf_counter()
+            images = np.stack([img for img, _ in items])
+            serving = np.stack([probs for _, probs in items])
+            try:
+                candidate = np.asarray(self.candidate(images, training=False))
+            except Exception as e:
+                print("⚠️ Shadow inference failed:", e)
+                continue
+            elapsed = time.perf_counter() - start
+
+            self._record(serving, candidate, elapsed)
+
+            # Back off so the shadow uses at most max_duty of the CPU time;
+            # samples arriving meanwhile queue up or are dropped.
+            self._stop.wait(elapsed * (1.0 / self.max_duty - 1.0))
+
+    def _record(self, serving, candidate, elapsed):
+        serving_cls = serving.argmax(axis=1)
+        candidate_cls = candidate.argmax(axis=1)
+        shift = candidate.max(axis=1) - serving.max(axis=1)
+
+        with self._lock:
+            self.scored += len(serving_cls)
+            self.agreed += int((serving_cls == candidate_cls).sum())
+            self.confidence_shift_sum += float(shift.sum())
+            self.abs_confidence_shift_sum += float(np.abs(shift).sum())
+            np.add.at(self.confusion, (serving_cls, candidate_cls), 1)
+            self.batches += 1
+            self.batch_seconds += elapsed
+
+    # ---------- reporting ----------
+    def stats(self):
+        with self._lock:
+            scored = max(self.scored, 1)
+            disagreements = {}
+            for i, j in zip(*np.nonzero(self.confusion)):
+                if i != j:
+                    key = f"{self.class_names[i]}->{self.class_names[j]}"
+                    disagreements[key] = int(self.confusion[i, j])
+
+            return {
+                "candidate_version": self.candidate_version,
+                "sample_rate": self.sample_rate,
+                "submitted": self.submitted,
+                "dropped": self.dropped,
+                "queued": self._queue.qsize(),
+                "scored": self.scored,
+                "agreement_rate": round(self.agreed / scored, 4) if self.scored else None,
+                "mean_confidence_shift": round(self.confidence_shift_sum / scored, 4),
+                "mean_abs_confidence_shift": round(self.abs_confidence_shift_sum / scored, 4),
+                "avg_batch_ms": round(1000 * self.batch_seconds / max(self.batches, 1), 2),
+                "disagreements": disagreements,
+            }
@@ -152,6 +152,16 @@ elif page == "♻️ Retrain Model":
                     st.write(f"Epochs: {result['epochs']}")
                     st.write(f"Final Train Accuracy: {result['final_train_acc']:.3f}")
                     st.write(f"Final Val Accuracy: {result['final_val_acc']:.3f}")
+                    if result.get("stopped_early"):
+                        st.info(f"Stopped early — saved {result['epochs_saved']} epochs "
+                                f"(~{result['seconds_saved']} sec)")
+                    if result.get("resumed_from_epoch"):
+                        st.info(f"Resumed from checkpoint at epoch {result['resumed_from_epoch']}")
+                    if result.get("pipeline_images_per_sec") is not None:
+                        st.write(f"Input pipeline: {result['pipeline_images_per_sec']} img/s, "
+                                 f"training: {result['train_images_per_sec']} img/s")
+                        if result.get("input_bound"):
+                            st.warning("Input pipeline barely outruns training — CPU input may be the bottleneck.")
             except:
                 print("Retraining failed (API unreachable).")
 
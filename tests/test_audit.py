@@ -0,0 +1,59 @@
+# tests/test_audit.py
+
+import builtins
+
+import pytest
+
+from src import audit
+from src.audit import AuditLog, list_segments, read_audit_log
+
+
+def _record(log, n):
+    for i in range(n):
+        log.record(f"hash{i}", "melanoma", 0.9, "v1", 1.0)
+
+
+class _PartialWrite:
+    """File stand-in that writes half of the data, then fails like a full disk."""
+
+    def __init__(self, path, mode):
+        self._f = builtins.open(path, mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+    def write(self, data):
+        self._f.write(data[: len(data) // 2])
+        raise OSError("No space left on device")
+
+
+def test_flush_round_trip(tmp_path):
+    log = AuditLog(tmp_path)
+    _record(log, 3)
+
+    assert log.flush() == 3
+    records = list(read_audit_log(tmp_path))
+    assert [r["input_hash"] for r in records] == ["hash0", "hash1", "hash2"]
+
+
+def test_failed_write_is_retried_in_a_new_segment(tmp_path, monkeypatch):
+    log = AuditLog(tmp_path)
+    _record(log, 5)
+
+    monkeypatch.setattr(audit, "open", _PartialWrite, raising=False)
+    with pytest.raises(OSError):
+        log.flush()
+    monkeypatch.delattr(audit, "open")
+
+    assert log.stats()["buffered"] == 5
+    assert log.flush() == 5
+
+    segments = list_segments(tmp_path)
+    assert len(segments) == 2
+    assert segments[0].name != segments[1].name
+
+    records = list(read_audit_log(tmp_path))
+    assert [r["input_hash"] for r in records] == [f"hash{i}" for i in range(5)]
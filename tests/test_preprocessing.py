@@ -0,0 +1,145 @@
+# tests/test_preprocessing.py
+#
+# Serving / training preprocessing parity, agreement with the old PIL +
+# float64 serving path, and the memory a request's preprocessing costs.
+
+import ctypes
+import gc
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+tf = pytest.importorskip("tensorflow")
+Image = pytest.importorskip("PIL.Image")
+
+from src.prediction import MODEL_PATH, get_model, preprocess_bytes
+from src.preprocessing import IMG_SIZE, load_image_dataset, unwrap_preprocessing
+
+TEST_IMAGES = sorted((Path(__file__).resolve().parents[1] / "data" / "test_images").glob("*.jpg"))
+
+# The old path resized with PIL (bicubic, antialiased); the shared path uses
+# TF bilinear. Predictions may move by this much, never change class.
+LEGACY_PROB_TOLERANCE = 0.1
+
+needs_images = pytest.mark.skipif(not TEST_IMAGES, reason="no images in data/test_images")
+needs_model = pytest.mark.skipif(not MODEL_PATH.exists(), reason=f"{MODEL_PATH} not available")
+
+
+def _legacy_preprocess(img_bytes):
+    """Serving preprocessing before the shared decode: PIL resize, float64 / 255."""
+    img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
+    return np.expand_dims(np.array(img.resize(IMG_SIZE)) / 255.0, axis=0)
+
+
+@pytest.fixture(scope="module")
+def model():
+    return get_model()
+
+
+# -------------------------------------
+# PIXEL PARITY
+# -------------------------------------
+@needs_images
+def test_serving_matches_training_pixels():
+    batches = load_image_dataset([str(p) for p in TEST_IMAGES], batch_size=1)
+    for path, train_input in zip(TEST_IMAGES, batches):
+        served = preprocess_bytes(path.read_bytes())
+        assert served.dtype == np.uint8
+        np.testing.assert_array_equal(served, train_input.numpy())
+
+
+def test_pil_fallback_for_formats_tf_cannot_decode():
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, size=(300, 400, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format="TIFF")
+
+    served = preprocess_bytes(buf.getvalue())
+
+    assert served.shape == (1, *IMG_SIZE, 3)
+    assert served.dtype == np.uint8
+
+
+# -------------------------------------
+# MODEL OUTPUTS
+# -------------------------------------
+@needs_images
+@needs_model
+def test_in_graph_rescale_matches_float_path(model):
+    classifier = unwrap_preprocessing(model)
+    for path in TEST_IMAGES:
+        served = preprocess_bytes(path.read_bytes())
+        p_uint8 = model.predict(served, verbose=0)
+        p_float = classifier.predict(served.astype(np.float32) / 255.0, verbose=0)
+        np.testing.assert_allclose(p_uint8, p_float, atol=1e-4)
+
+
+@needs_images
+@needs_model
+def test_close_to_legacy_serving_path(model):
+    classifier = unwrap_preprocessing(model)
+    for path in TEST_IMAGES:
+        img_bytes = path.read_bytes()
+        p_new = model.predict(preprocess_bytes(img_bytes), verbose=0)
+        p_legacy = classifier.predict(_legacy_preprocess(img_bytes), verbose=0)
+
+        assert np.argmax(p_new) == np.argmax(p_legacy), path.name
+        assert np.max(np.abs(p_new - p_legacy)) < LEGACY_PROB_TOLERANCE, path.name
+
+
+# -------------------------------------
+# MEMORY PER REQUEST
+# -------------------------------------
+def _status_bytes(field):
+    for line in Path("/proc/self/status").read_text().splitlines():
+        if line.startswith(field + ":"):
+            return int(line.split()[1]) * 1024
+    raise KeyError(field)
+
+
+def _pin_mmap_threshold(nbytes=128 * 1024):
+    """
+    glibc raises its mmap threshold after large frees, after which freed
+    image buffers stay resident and later requests look free. Pinning it
+    keeps large blocks mmapped and returned to the OS on free.
+    """
+    try:
+        ctypes.CDLL("libc.so.6").mallopt(-3, nbytes)   # M_MMAP_THRESHOLD
+    except OSError:
+        pass
+
+
+def _peak_rss_growth(fn, repeats=5):
+    """
+    Peak resident memory fn adds on top of the current RSS, lowest of
+    `repeats` runs. Counts every allocator (PIL, numpy, TF), including
+    intermediates freed before fn returns, which tracemalloc does not see.
+    """
+    fn()   # warm-up: decoder init, op kernels
+    growth = []
+    for _ in range(repeats):
+        gc.collect()
+        Path("/proc/self/clear_refs").write_text("5")   # reset VmHWM to current RSS
+        before = _status_bytes("VmRSS")
+        result = fn()
+        growth.append(_status_bytes("VmHWM") - before)
+        del result
+    return min(growth)
+
+
+@needs_images
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads /proc/self")
+def test_request_preprocessing_uses_less_memory_than_legacy():
+    img_bytes = TEST_IMAGES[0].read_bytes()
+    _pin_mmap_threshold()
+    try:
+        legacy = _peak_rss_growth(lambda: _legacy_preprocess(img_bytes))
+        shared = _peak_rss_growth(lambda: preprocess_bytes(img_bytes))
+    except OSError as e:
+        pytest.skip(f"cannot reset peak RSS: {e}")
+
+    print(f"peak RSS growth per request: legacy={legacy} B, shared={shared} B")
+    assert shared < legacy